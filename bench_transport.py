@@ -0,0 +1,119 @@
+"""Compares TLS handshakes per 1k Bot API calls against a local HTTPS fake API.
+
+Usage: python bench_transport.py [calls] [threads]
+
+Needs the `openssl` binary to create a throwaway self-signed certificate.
+"""
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import telebot
+from telebot import apihelper
+
+from transport import BotTransport
+
+FAKE_MESSAGE = {"ok": True, "result": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}}
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _answer(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        body = json.dumps(FAKE_MESSAGE).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _answer
+    do_POST = _answer
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, context):
+        super().__init__(address, FakeApiHandler)
+        self.context = context
+        self.handshakes = 0
+        self._lock = threading.Lock()
+
+    def get_request(self):
+        sock, address = super().get_request()
+        with self._lock:
+            self.handshakes += 1
+        return self.context.wrap_socket(sock, server_side=True), address
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def run(server, name, sender, calls, threads):
+    apihelper.CUSTOM_REQUEST_SENDER = sender
+    apihelper.session = None
+    bot = telebot.TeleBot("123:bench", threaded=False)
+
+    server.handshakes = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda i: bot.send_message(1, f"ping {i}"), range(calls)))
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:<16} {server.handshakes * 1000 / calls:>10.1f} {calls / elapsed:>10.0f}")
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+
+        server = FakeApiServer(("127.0.0.1", 0), context)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        apihelper.API_URL = f"https://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}"
+        # Trust the throwaway certificate in every requests code path
+        os.environ["REQUESTS_CA_BUNDLE"] = cert
+
+        transport = BotTransport(pool_maxsize=threads, verify=cert)
+
+        print(f"{calls} calls, {threads} threads")
+        print(f"{'transport':<16} {'hs/1k':>10} {'calls/s':>10}")
+        run(server, "no keep-alive", lambda method, url, **kwargs: requests.request(method, url, **kwargs), calls, threads)
+        run(server, "telebot default", None, calls, threads)
+        run(server, "pooled", transport.request, calls, threads)
+        print(f"pooled transport metrics: {transport.metrics()}")
+
+        transport.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
-import os, json, time, telebot, traceback
-from telebot import types
-from datetime import datetime
+import os, json, time, telebot, traceback, hmac, html
+from telebot import types, apihelper
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from db import Database
-from flask import Flask, Response
+from routing import SupporterRouter, ForumShards
+from breaker import CircuitBreaker, CircuitOpenError, ReplayBuffer
+from transport import BotTransport
+from broadcast import RateLimiter, BulkJob, call_with_retry
+from stats import Stats
+from flask import Flask, Response, jsonify, request
 import threading
 import logging
+from functools import wraps
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -16,11 +22,32 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHAT_ID = int(os.getenv("CHAT_ID", "-1"))
+# Extra support forums to shard sessions across; CHAT_ID stays the primary one
+CHAT_IDS = [CHAT_ID] + [int(c) for c in os.getenv("EXTRA_CHAT_IDS", "").split(",") if c.strip()]
+SHARD_STRATEGY = os.getenv("SHARD_STRATEGY", "hash")
 ENABLE_LOGGING = bool(int(os.getenv("ENABLE_LOGGING", "1")))
 ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "-1"))
 RETRY_DELAY = float(os.getenv("RETRY_DELAY", "2.0"))
 FLASK_PORT = int(os.getenv("FLASK_PORT", "5000"))
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+# Bearer token for /stats and /metrics; both stay disabled without it
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+SUPPORTER_ACTIVE_WINDOW = int(os.getenv("SUPPORTER_ACTIVE_WINDOW", "1800"))
+ROUTING_PERSIST_INTERVAL = float(os.getenv("ROUTING_PERSIST_INTERVAL", "60"))
+STATS_PERSIST_INTERVAL = float(os.getenv("STATS_PERSIST_INTERVAL", "60"))
+API_BREAKER_THRESHOLD = int(os.getenv("API_BREAKER_THRESHOLD", "5"))
+API_BREAKER_RESET = float(os.getenv("API_BREAKER_RESET", "15"))
+MESSAGE_BUFFER_SIZE = int(os.getenv("MESSAGE_BUFFER_SIZE", "1000"))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "8"))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "15"))
+API_HTTP2 = bool(int(os.getenv("API_HTTP2", "0")))
+# Telegram allows ~30 messages/s across chats and ~20 messages/min into one group
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+GROUP_RATE = float(os.getenv("GROUP_RATE", "20"))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "100"))
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "4"))
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "5"))
 
 logger.info(f"Bot starting at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 logger.info(f"Environment: {ENVIRONMENT}")
@@ -32,6 +59,40 @@ def healthcheck():
     logger.debug("Healthcheck endpoint called")
     return Response("OK", status=200)
 
+def token_required(view):
+    # The port is published, so anything beyond the healthcheck needs the token
+    @wraps(view)
+    def wrapper():
+        supplied = request.headers.get("Authorization", "")
+        if not METRICS_TOKEN or not hmac.compare_digest(supplied, f"Bearer {METRICS_TOKEN}"):
+            return Response("Forbidden", status=403)
+        return view()
+    return wrapper
+
+@app.route("/stats")
+@token_required
+def stats_endpoint():
+    snapshot = dict(stats.snapshot())
+    # Supporter ids stay in the admin-only /stats command
+    supporters = snapshot["supporters"].values()
+    snapshot["supporters"] = {
+        "count": len(supporters),
+        "replies": sum(counts["replies"] for counts in supporters),
+    }
+    return jsonify(snapshot)
+
+@app.route("/metrics")
+@token_required
+def metrics():
+    return jsonify({
+        "routing": router.metrics(),
+        "shards": shards.metrics(),
+        "breakers": {"postgres": db_breaker.metrics(), "telegram": api_breaker.metrics()},
+        "buffer": message_buffer.metrics(),
+        "transport": transport.metrics(),
+        "jobs": {str(job.job_id): job.metrics() for job in running_jobs()}
+    })
+
 def start_flask():
     logger.info(f"Starting Flask server on port {FLASK_PORT}")
     try:
@@ -51,18 +112,65 @@ time.sleep(1)
 logger.info("Continuing with bot initialization")
 
 db = Database()
+db_breaker = db.breaker
+router = SupporterRouter(active_window=SUPPORTER_ACTIVE_WINDOW)
+shards = ForumShards(CHAT_IDS, strategy=SHARD_STRATEGY)
+stats = Stats()
 
 with open("langs.json", "r", encoding="utf-8") as f:
     LANG_TEXTS = json.load(f)
 
 def get_text(key, chat_id):
-    user_lang = db.get_language(chat_id)
+    try:
+        user_lang = db.get_language(chat_id)
+    except CircuitOpenError:
+        # Still answer while the database is down, just not localized
+        user_lang = "English"
     return LANG_TEXTS.get(key, {}).get(user_lang, LANG_TEXTS[key]["English"])
 
-def log_message(kitten_id, forum_id, message, supporter_id=None):
+def log_message(kitten_id, chat_id, forum_id, message, supporter_id=None):
+    stats.message(kitten_id, supporter_id)
     if not ENABLE_LOGGING:
         return
-    db.log_message(kitten_id, forum_id, message, supporter_id)
+    try:
+        db.log_message(kitten_id, forum_id, message, supporter_id, chat_id=chat_id)
+    except Exception as e:
+        # Runs after the message was delivered, so it must not trigger a replay
+        logger.warning(f"[!] Message log skipped: {e}")
+
+transport = BotTransport(
+    pool_maxsize=API_POOL_SIZE,
+    connect_timeout=API_CONNECT_TIMEOUT,
+    read_timeout=API_READ_TIMEOUT,
+    http2=API_HTTP2
+)
+# telebot stretches the read timeout itself for long polling
+apihelper.CONNECT_TIMEOUT = API_CONNECT_TIMEOUT
+apihelper.READ_TIMEOUT = API_READ_TIMEOUT
+
+api_breaker = CircuitBreaker("telegram", failure_threshold=API_BREAKER_THRESHOLD, reset_timeout=API_BREAKER_RESET)
+message_buffer = ReplayBuffer(maxlen=MESSAGE_BUFFER_SIZE)
+
+def guarded_request(method, url, **kwargs):
+    # Every Bot API call goes through here, so the breaker sees transport
+    # errors and 5xx answers; regular API errors (4xx) are not outages
+    if not api_breaker.allow():
+        raise CircuitOpenError(api_breaker.name, api_breaker.retry_after())
+    try:
+        response = transport.request(method, url, **kwargs)
+    except Exception:
+        api_breaker.record_failure()
+        raise
+    if response.status_code >= 500:
+        api_breaker.record_failure()
+    else:
+        api_breaker.record_success()
+    return response
+
+apihelper.CUSTOM_REQUEST_SENDER = guarded_request
+
+def dependencies_available():
+    return db_breaker.available and api_breaker.available
 
 bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
 
@@ -88,6 +196,76 @@ def report_error(error_message):
         except:
             print("[-] Failed to send even plain text error message")
 
+def help_chat_id(help_request):
+    # Rows created before sharding have no chat recorded
+    return help_request.get('chat_id') or shards.primary
+
+def notify_assignment(topic, supporter_id):
+    chat_id, thread_id = topic
+    chat_id = chat_id or shards.primary
+    try:
+        mention = f'<a href="tg://user?id={supporter_id}">{supporter_id}</a>'
+        bot.send_message(
+            chat_id,
+            get_text("supporter_assigned", chat_id).format(supporter=mention),
+            parse_mode="HTML",
+            reply_to_message_id=thread_id
+        )
+    except Exception as e:
+        print(f"[-] Failed to notify assigned supporter: {e}")
+
+broadcast_limiter = RateLimiter(BROADCAST_RATE)
+group_limiters = {chat_id: RateLimiter(GROUP_RATE, per=60) for chat_id in CHAT_IDS}
+active_jobs = {}
+job_progress = {}  # job_id -> (admin message id, last update time)
+jobs_lock = threading.Lock()  # job threads, handlers and Flask all touch the two dicts above
+
+def running_jobs():
+    with jobs_lock:
+        return list(active_jobs.values())
+
+def persist_routing():
+    while True:
+        time.sleep(ROUTING_PERSIST_INTERVAL)
+        try:
+            db.save_supporters(router.snapshot())
+        except Exception as e:
+            logger.error(f"[-] Failed to persist routing state: {e}")
+
+def persist_stats():
+    while True:
+        time.sleep(STATS_PERSIST_INTERVAL)
+        try:
+            db.save_stats(stats.dump())
+        except Exception as e:
+            logger.error(f"[-] Failed to persist stats: {e}")
+
+def replay_buffered_messages():
+    while True:
+        time.sleep(1)
+        if not len(message_buffer):
+            continue
+        replayed = message_buffer.replay(process_message, dependencies_available)
+        if replayed:
+            logger.info(f"[+] Replayed {replayed} buffered message(s)")
+
+def degraded(handler):
+    # Commands and button presses are not buffered; tell the user to retry instead
+    @wraps(handler)
+    def wrapper(update):
+        try:
+            return handler(update)
+        except CircuitOpenError as e:
+            logger.warning(f"[!] {handler.__name__} rejected: {e}")
+            try:
+                if hasattr(update, "data"):
+                    bot.answer_callback_query(update.id, text=get_text("service_unavailable", update.message.chat.id))
+                else:
+                    bot.send_message(update.chat.id, get_text("service_unavailable", update.chat.id), parse_mode="HTML")
+            except Exception as notify_error:
+                print(f"[-] Failed to send unavailable notice: {notify_error}")
+    return wrapper
+
 def create_language_markup():
     markup = types.InlineKeyboardMarkup(row_width=3)
     markup.add(
@@ -111,6 +289,7 @@ def create_session_markup(chat_id):
     return markup
 
 @bot.message_handler(commands=['start'])
+@degraded
 def start(message):
     markup = create_language_markup()
     bot.send_message(
@@ -120,6 +299,7 @@ def start(message):
     )
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('lang_'))
+@degraded
 def language_callback(call):
     language = call.data.split('_')[1]
     language_display = {"Russian": "Русский", "English": "English", "Kazakh": "Қазақша"}
@@ -138,6 +318,7 @@ def language_callback(call):
     bot.answer_callback_query(call.id)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('disclaimer_'))
+@degraded
 def disclaimer_callback(call):
     action = call.data.split('_')[1]
     
@@ -161,6 +342,7 @@ def disclaimer_callback(call):
     bot.answer_callback_query(call.id)
 
 @bot.message_handler(commands=['switch_language'])
+@degraded
 def switch_language(message):
     markup = create_language_markup()
     bot.send_message(
@@ -170,6 +352,7 @@ def switch_language(message):
     )
 
 @bot.message_handler(commands=['help'])
+@degraded
 def help_command(message):
     txt_list = message.text.split(" ")
     
@@ -194,12 +377,19 @@ def help_command(message):
         )
         return
 
-    # Creating new help in db
-    result = db.create_help(message.from_user.id)
+    # Creating new help in db, pinned to one of the support forums
+    support_chat_id = shards.pick(message.from_user.id)
+    forum_topic = None
+    try:
+        result = db.create_help(message.from_user.id, chat_id=support_chat_id)
+    except Exception:
+        shards.closed(support_chat_id)
+        raise
     
     try:
         # Create a forum topic in the support group
-        forum_topic = bot.create_forum_topic(CHAT_ID, f"Kitten #{result['id']}")
+        forum_topic = bot.create_forum_topic(support_chat_id, f"Kitten #{result['id']}")
+        stats.session_opened(message.from_user.id)
 
         # Update thread ID in helps database and send the message
         db.update_thread_id(message.from_user.id, forum_topic.message_thread_id)
@@ -208,12 +398,18 @@ def help_command(message):
         help_text = ' '.join(txt_list) 
         
         bot.send_message(
-            CHAT_ID, 
+            support_chat_id, 
             help_text,
             reply_to_message_id=forum_topic.message_thread_id
         )
         
-        log_message(message.from_user.id, forum_topic.message_thread_id, help_text)
+        log_message(message.from_user.id, support_chat_id, forum_topic.message_thread_id, help_text)
+
+        # Hand the request to the least-loaded active supporter, if any
+        topic = (support_chat_id, forum_topic.message_thread_id)
+        supporter_id = router.open_session(message.from_user.id, topic)
+        if supporter_id is not None:
+            notify_assignment(topic, supporter_id)
         
         bot.send_message(
             message.from_user.id,
@@ -222,6 +418,9 @@ def help_command(message):
             reply_markup=create_session_markup(message.chat.id)
         )
     except Exception as e:
+        if forum_topic is None:
+            # Give back the reservation made by shards.pick
+            shards.closed(support_chat_id)
         print(f"[-] Error in help_command: {e}")
         report_error(e)
         bot.send_message(
@@ -232,10 +431,12 @@ def help_command(message):
         )
 
 @bot.message_handler(commands=['close'])
+@degraded
 def close_command(message):
     close_session(message.from_user.id, message.chat.id)
 
 @bot.callback_query_handler(func=lambda call: call.data == 'finish_session')
+@degraded
 def finish_session_callback(call):
     close_session(call.from_user.id, call.message.chat.id)
     bot.answer_callback_query(call.id, text=get_text("dialog_ended", call.message.chat.id))
@@ -259,15 +460,16 @@ def close_session(user_id, chat_id):
                     return
 
                 # Send closing message to the support group
+                support_chat_id = help_chat_id(help_request)
                 try:
                     # First check if we can send a message to the thread
                     bot.send_message(
-                        CHAT_ID, 
+                        support_chat_id, 
                         get_text("anonymous_session_closed", chat_id),
                         message_thread_id=help_request['thread_id']
                     )
                     # Then try to close the forum topic
-                    bot.close_forum_topic(CHAT_ID, help_request['thread_id'])
+                    bot.close_forum_topic(support_chat_id, help_request['thread_id'])
                 except telebot.apihelper.ApiTelegramException as e:
                     if "chat not found" in str(e).lower():
                         print(f"[-] Chat not found when closing forum topic: {e}")
@@ -291,6 +493,9 @@ def close_session(user_id, chat_id):
                 parse_mode="HTML"
             )
             db.delete_help(user_id)
+            router.close_session(user_id)
+            stats.session_closed(user_id)
+            shards.closed(support_chat_id)
         except Exception as e:
             print(f"[-] Error in close_session: {e}")
             report_error(e)
@@ -306,8 +511,256 @@ def close_session(user_id, chat_id):
             parse_mode="HTML"
         )
 
+def is_admin(message):
+    return message.chat.id == ADMIN_CHAT_ID
+
+def send_broadcast(chat_id, text):
+    broadcast_limiter.acquire()
+    call_with_retry(lambda: bot.send_message(chat_id, text))
+    return True
+
+def close_stale_help(help_request):
+    kitten_id = help_request['kitten_id']
+    support_chat_id = help_chat_id(help_request)
+    limiter = group_limiters.get(support_chat_id) or group_limiters[shards.primary]
+
+    if help_request['thread_id']:
+        try:
+            limiter.acquire()
+            call_with_retry(lambda: bot.send_message(
+                support_chat_id,
+                get_text("anonymous_session_closed", kitten_id),
+                message_thread_id=help_request['thread_id']
+            ))
+            limiter.acquire()
+            call_with_retry(lambda: bot.close_forum_topic(support_chat_id, help_request['thread_id']))
+        except telebot.apihelper.ApiTelegramException as e:
+            # The topic may already be gone; the stale record still has to go
+            print(f"[-] Could not close forum topic {help_request['thread_id']}: {e}")
+
+    try:
+        broadcast_limiter.acquire()
+        call_with_retry(lambda: bot.send_message(
+            kitten_id,
+            get_text("inactivity_closed", kitten_id),
+            parse_mode="HTML"
+        ))
+    except telebot.apihelper.ApiTelegramException as e:
+        print(f"[-] Could not notify {kitten_id} about closed session: {e}")
+
+    db.delete_help(kitten_id)
+    router.close_session(kitten_id)
+    stats.session_closed(kitten_id)
+    shards.closed(support_chat_id)
+    return True
+
+def checkpoint_job(job):
+    db.update_job(
+        job.job_id,
+        cursor=job.cursor,
+        processed=job.processed,
+        succeeded=job.succeeded,
+        failed=job.failed,
+        status=job.status
+    )
+
+def format_job(job):
+    text = (
+        f"<b>Job #{job.job_id}</b> ({job.kind}): {job.status}\n"
+        f"Processed: {job.processed}, succeeded: {job.succeeded}, failed: {job.failed}\n"
+        f"Throughput: {job.throughput:.1f}/s"
+    )
+    if job.status == "interrupted":
+        text += f"\nResume with /resume_job {job.job_id}"
+    return text
+
+def report_job_progress(job):
+    with jobs_lock:
+        message_id, last_update = job_progress.get(job.job_id, (None, 0))
+    now = time.monotonic()
+    if job.status == "running" and now - last_update < JOB_PROGRESS_INTERVAL:
+        return
+    try:
+        if message_id is None:
+            message_id = bot.send_message(ADMIN_CHAT_ID, format_job(job), parse_mode="HTML").message_id
+        else:
+            bot.edit_message_text(format_job(job), ADMIN_CHAT_ID, message_id, parse_mode="HTML")
+    except Exception as e:
+        print(f"[-] Failed to report job progress: {e}")
+    with jobs_lock:
+        job_progress[job.job_id] = (message_id, now)
+        if job.status != "running":
+            active_jobs.pop(job.job_id, None)
+            job_progress.pop(job.job_id, None)
+
+def start_job(job_row):
+    payload = json.loads(job_row['payload'])
+
+    if job_row['kind'] == "broadcast":
+        def fetch_batch(cursor):
+            chat_ids = db.get_language_chat_ids(after=cursor, limit=BULK_BATCH_SIZE)
+            return chat_ids, chat_ids[-1] if chat_ids else cursor
+        handle = lambda chat_id: send_broadcast(chat_id, payload['text'])
+    elif job_row['kind'] == "close_stale":
+        before = datetime.fromisoformat(payload['before'])
+        def fetch_batch(cursor):
+            helps = db.get_stale_helps(before, after=cursor, limit=BULK_BATCH_SIZE)
+            return helps, helps[-1]['id'] if helps else cursor
+        handle = close_stale_help
+    else:
+        print(f"[-] Unknown job kind: {job_row['kind']}")
+        return None
+
+    job = BulkJob(
+        job_row['id'], job_row['kind'], fetch_batch, handle, checkpoint_job,
+        cursor=job_row['cursor'],
+        processed=job_row['processed'] or 0,
+        succeeded=job_row['succeeded'] or 0,
+        failed=job_row['failed'] or 0,
+        workers=BULK_WORKERS,
+        on_progress=report_job_progress
+    )
+    with jobs_lock:
+        active_jobs[job.job_id] = job
+    report_job_progress(job)
+
+    job_thread = threading.Thread(target=job.run)
+    job_thread.daemon = True
+    job_thread.start()
+    return job
+
+def resume_unfinished_jobs():
+    # Only close_stale jobs that were cut off by a restart pick up on their
+    # own; a broadcast resent days later needs an admin to ask for it
+    for job_row in db.get_unfinished_jobs():
+        if job_row['kind'] == "close_stale" and job_row['status'] == "running":
+            logger.info(f"[*] Resuming {job_row['kind']} job #{job_row['id']} from checkpoint")
+            start_job(job_row)
+            continue
+
+        if job_row['status'] != "interrupted":
+            db.update_job(job_row['id'], status="interrupted")
+        logger.info(f"[*] {job_row['kind']} job #{job_row['id']} is waiting for /resume_job")
+        try:
+            bot.send_message(
+                ADMIN_CHAT_ID,
+                f"<b>Job #{job_row['id']}</b> ({job_row['kind']}) was interrupted after {job_row['processed'] or 0} target(s). "
+                f"Resume with /resume_job {job_row['id']}; up to {BULK_BATCH_SIZE} target(s) of the last batch may be handled twice.",
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"[-] Failed to report interrupted job: {e}")
+
+def format_stats():
+    snapshot = stats.snapshot()
+    sessions, first_reply, messages = snapshot['sessions'], snapshot['first_reply'], snapshot['messages']
+    last_hour = sessions['per_hour'][-1]
+    last_day_opened = sum(hour['opened'] for hour in sessions['per_hour'])
+    top_supporters = sorted(snapshot['supporters'].items(), key=lambda item: item[1]['replies'], reverse=True)[:5]
+
+    lines = [
+        "<b>Sessions</b>",
+        f"Opened: {sessions['opened']}, closed: {sessions['closed']}",
+        f"This hour: {last_hour['opened']} opened, {last_hour['closed']} closed",
+        f"Last 24h: {last_day_opened} opened",
+        "",
+        "<b>First supporter reply</b>",
+        f"Average: {first_reply['avg_seconds']}s, max: {first_reply['max_seconds']}s ({first_reply['count']} sessions)",
+        "",
+        "<b>Messages</b>",
+        f"Total: {messages['total']}, per session: {messages['per_session_avg']} avg, {messages['per_session_max']} max",
+    ]
+    if top_supporters:
+        lines += ["", "<b>Top supporters</b>"]
+        lines += [f"{supporter_id}: {counts['replies']} replies in {counts['sessions']} sessions" for supporter_id, counts in top_supporters]
+    return "\n".join(lines)
+
+@bot.message_handler(commands=['stats'], func=is_admin)
+def stats_command(message):
+    bot.send_message(message.chat.id, format_stats(), parse_mode="HTML")
+
+@bot.message_handler(commands=['broadcast'], func=is_admin)
+@degraded
+def broadcast_command(message):
+    text = message.text.partition(" ")[2].strip()
+    if not text:
+        bot.send_message(message.chat.id, "Usage: /broadcast <text>")
+        return
+    # The text goes out as HTML; a preview catches markup Telegram would
+    # reject for every single recipient
+    try:
+        bot.send_message(message.chat.id, text)
+    except telebot.apihelper.ApiTelegramException as e:
+        if e.error_code != 400:
+            raise
+        bot.send_message(
+            message.chat.id,
+            f"Broadcast not started, Telegram rejected the text: {html.escape(e.description, quote=False)}\n"
+            f"Escape &lt; &gt; &amp; as &amp;lt; &amp;gt; &amp;amp; or fix the HTML tags."
+        )
+        return
+    start_job(db.create_job("broadcast", {"text": text}))
+
+@bot.message_handler(commands=['close_stale'], func=is_admin)
+@degraded
+def close_stale_command(message):
+    argument = message.text.partition(" ")[2].strip()
+    try:
+        hours = float(argument) if argument else 3
+    except ValueError:
+        bot.send_message(message.chat.id, "Usage: /close_stale [hours of inactivity, default 3]")
+        return
+    before = datetime.now() - timedelta(hours=hours)
+    start_job(db.create_job("close_stale", {"before": before.isoformat()}))
+
+@bot.message_handler(commands=['jobs'], func=is_admin)
+def jobs_command(message):
+    jobs = running_jobs()
+    if not jobs:
+        bot.send_message(message.chat.id, "No bulk jobs are running.")
+        return
+    bot.send_message(message.chat.id, "\n\n".join(format_job(job) for job in jobs), parse_mode="HTML")
+
+@bot.message_handler(commands=['cancel_job'], func=is_admin)
+def cancel_job_command(message):
+    argument = message.text.partition(" ")[2].strip()
+    with jobs_lock:
+        job = active_jobs.get(int(argument)) if argument.isdigit() else None
+    if not job:
+        bot.send_message(message.chat.id, "Usage: /cancel_job <id of a running job>")
+        return
+    job.cancel()
+
+@bot.message_handler(commands=['resume_job'], func=is_admin)
+@degraded
+def resume_job_command(message):
+    argument = message.text.partition(" ")[2].strip()
+    job_row = db.get_job(int(argument)) if argument.isdigit() else None
+    with jobs_lock:
+        running = job_row is not None and job_row['id'] in active_jobs
+    if not job_row or running or job_row['status'] not in ("running", "interrupted"):
+        bot.send_message(message.chat.id, "Usage: /resume_job <id of an interrupted job>")
+        return
+    db.update_job(job_row['id'], status="running")
+    start_job(job_row)
+
 @bot.message_handler(content_types=['text', 'photo', 'document'])
 def handle_messages(message: telebot.types.Message):
+    # While a dependency is down, and until the backlog is drained, keep messages in order
+    if len(message_buffer) or not dependencies_available():
+        buffer_message(message)
+        return
+    try:
+        process_message(message)
+    except CircuitOpenError:
+        # process_message only lets this through before anything was sent
+        buffer_message(message)
+
+def buffer_message(message):
+    if not message_buffer.add(message):
+        logger.warning(f"[!] Message buffer full, dropping message from {message.from_user.id}")
+
+def process_message(message):
     print(f"[*] Message from {message.from_user.id}: {message.text if message.content_type == 'text' else message.content_type}")
 
     # Check for inactivity
@@ -336,15 +789,25 @@ def handle_messages(message: telebot.types.Message):
                     reply_markup=create_session_markup(message.chat.id),
                     parse_mode="HTML"
                 )
-                db.delete_help(message.from_user.id)
+                try:
+                    db.delete_help(message.from_user.id)
+                except CircuitOpenError as e:
+                    # The user was already told; the next message closes it again
+                    logger.warning(f"[!] Could not delete inactive session: {e}")
+                    return
+                router.close_session(message.from_user.id)
+                stats.session_closed(message.from_user.id)
+                shards.closed(help_chat_id(help_request))
                 return
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"[-] Error in inactivity check: {e}")
             report_error(e)
 
     # Handle user messages to forward to support chat
-    print("Message Chat ID: ", message.chat.id, "Group chat ID:", CHAT_ID)
-    if message.chat.id != CHAT_ID:
+    print("Message Chat ID: ", message.chat.id, "Group chat IDs:", CHAT_IDS)
+    if message.chat.id not in shards:
         
         help_message = message.text
         user_chat_id = message.chat.id
@@ -364,11 +827,11 @@ def handle_messages(message: telebot.types.Message):
         # Forward message to support chat based on content type
         if message.content_type == 'text':
             bot.send_message(
-                chat_id=CHAT_ID,
+                chat_id=help_chat_id(help_request),
                 message_thread_id=forum_thread_id, 
                 text=help_message
             )
-            log_message(message.from_user.id, help_request['thread_id'], message.text)
+            log_message(message.from_user.id, help_chat_id(help_request), help_request['thread_id'], message.text)
         else: 
             bot.send_message(
                 message.chat.id,
@@ -378,14 +841,19 @@ def handle_messages(message: telebot.types.Message):
             return
 
     # Handle supporter replies in the forum
-    elif message.chat.id == CHAT_ID and message.message_thread_id:
+    elif message.message_thread_id:
         
-        help_request = db.get_help(thread_id=message.message_thread_id)
+        help_request = db.get_help(chat_id=message.chat.id, thread_id=message.message_thread_id)
         answer_message = message.text
-        forum_thread_id = help_request['thread_id']
-        kitten_id = help_request['kitten_id']
         
         if help_request:
+            forum_thread_id = help_request['thread_id']
+            kitten_id = help_request['kitten_id']
+
+            # Track supporter activity and hand out queued requests
+            for _, topic, supporter_id in router.record_reply(message.from_user.id, kitten_id):
+                notify_assignment(topic, supporter_id)
+
             header = get_text("supporter_message_header", message.chat.id)
             
             # Forward supporter message to user based on content type
@@ -396,27 +864,33 @@ def handle_messages(message: telebot.types.Message):
                         f"{header}\n\n{answer_message}",
                         parse_mode='HTML' 
                     )
-                    log_message(kitten_id, message.message_thread_id, message.text,
+                    log_message(kitten_id, message.chat.id, message.message_thread_id, message.text,
                               supporter_id=message.from_user.id)
+                except CircuitOpenError:
+                    # Only the send itself can get here, so nothing reached the user yet
+                    raise
                 except Exception as e:
                     print(f"[-] Error sending message to user: {e}")
                     report_error(e)
                     bot.send_message(
-                        CHAT_ID,
+                        message.chat.id,
                         f"Error sending your message: {str(e)}",
                         reply_to_message_id=message.message_thread_id
                     )
             else: 
                 bot.send_message(
-                    message.message_thread_id,
+                    message.chat.id,
                     "Unsupported content type. Currently, I support only texts.",
-                    parse_mode="HTML"
+                    parse_mode="HTML",
+                    reply_to_message_id=message.message_thread_id
                 )
                 return
 
     # Update last message time
     try:
         db.update_last_message_time(message.from_user.id)
+    except CircuitOpenError as e:
+        logger.warning(f"[!] Last message time not updated: {e}")
     except Exception as e:
         print(f"[-] Failed to update message time: {e}")
         report_error(e)
@@ -424,17 +898,56 @@ def handle_messages(message: telebot.types.Message):
 if __name__ == '__main__':
     logger.info("[+] Bot is now running!")
     
+    for support_chat_id in CHAT_IDS:
+        try:
+            logger.info(f"[*] Verifying support group (CHAT_ID: {support_chat_id})...")
+            chat_info = bot.get_chat(support_chat_id)
+            logger.info(f"[+] Support group verified: {chat_info.title}")
+            
+            if hasattr(chat_info, 'is_forum') and chat_info.is_forum:
+                logger.info("[+] Support group has forum capability")
+            else:
+                logger.warning("[!] Warning: Support group does not support forum topics")
+        except Exception as e:
+            logger.error(f"[-] Error verifying support group: {e}")
+
     try:
-        logger.info(f"[*] Verifying support group (CHAT_ID: {CHAT_ID})...")
-        chat_info = bot.get_chat(CHAT_ID)
-        logger.info(f"[+] Support group verified: {chat_info.title}")
-        
-        if hasattr(chat_info, 'is_forum') and chat_info.is_forum:
-            logger.info("[+] Support group has forum capability")
-        else:
-            logger.warning("[!] Warning: Support group does not support forum topics")
+        shards.restore(db.count_open_helps())
+        logger.info(f"[+] Sharding sessions across {len(CHAT_IDS)} support group(s) by {SHARD_STRATEGY}")
     except Exception as e:
-        logger.error(f"[-] Error verifying support group: {e}")
+        logger.error(f"[-] Failed to load open session counts: {e}")
+
+    try:
+        router.restore(db.get_supporters())
+        open_topics = {h['kitten_id']: (help_chat_id(h), h['thread_id']) for h in db.get_open_helps()}
+        for _, topic, supporter_id in router.reconcile(open_topics):
+            notify_assignment(topic, supporter_id)
+        logger.info("[+] Routing state restored")
+    except Exception as e:
+        logger.error(f"[-] Failed to restore routing state: {e}")
+
+    try:
+        stats.load(db.get_stats())
+        logger.info("[+] Stats restored")
+    except Exception as e:
+        logger.error(f"[-] Failed to restore stats: {e}")
+
+    stats_thread = threading.Thread(target=persist_stats)
+    stats_thread.daemon = True
+    stats_thread.start()
+
+    routing_thread = threading.Thread(target=persist_routing)
+    routing_thread.daemon = True
+    routing_thread.start()
+
+    try:
+        resume_unfinished_jobs()
+    except Exception as e:
+        logger.error(f"[-] Failed to resume bulk jobs: {e}")
+
+    replay_thread = threading.Thread(target=replay_buffered_messages)
+    replay_thread.daemon = True
+    replay_thread.start()
         
     while True:
         try:
@@ -444,6 +957,10 @@ if __name__ == '__main__':
             logger.error(f"[-] Polling Telegram API error: {te}")
             report_error(te)
             time.sleep(RETRY_DELAY)
+        except CircuitOpenError as ce:
+            # Nothing will get through until the breaker is ready to probe
+            logger.warning(f"[!] {ce}")
+            time.sleep(max(RETRY_DELAY, ce.retry_after))
         except Exception as e:
             logger.error(f"[-] Bot polling error: {e}")
             report_error(e)
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after=0):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fails fast while a dependency keeps erroring.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    every call is rejected with CircuitOpenError. Once `reset_timeout`
+    seconds have passed a single probe call is let through (half-open):
+    success closes the breaker again, failure reopens it.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, exceptions=(Exception,), clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.exceptions = exceptions
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._times_opened = 0
+        self._rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    @property
+    def available(self):
+        """Whether a call would currently be let through, without claiming the probe."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            return not self._probing and self.clock() - self._opened_at >= self.reset_timeout
+
+    def retry_after(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return 0
+            return max(0, self.reset_timeout - (self.clock() - self._opened_at))
+
+    def allow(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if not self._probing and self.clock() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._times_opened += 1
+                self._state = OPEN
+                self._opened_at = self.clock()
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+        try:
+            result = fn(*args, **kwargs)
+        except self.exceptions:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Errors the breaker does not track must not leave a probe hanging
+            with self._lock:
+                self._probing = False
+            raise
+        self.record_success()
+        return result
+
+    def metrics(self):
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+                "rejected_calls": self._rejected,
+            }
+
+
+class ReplayBuffer:
+    """Bounded FIFO of work deferred while a dependency is down.
+
+    Items stay at the head of the queue until they have been handled, so
+    anything added during a replay still lands behind them.
+    """
+
+    def __init__(self, maxlen=1000):
+        self.maxlen = maxlen
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._replayed = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def add(self, item):
+        with self._lock:
+            if len(self._items) >= self.maxlen:
+                self._dropped += 1
+                return False
+            self._items.append(item)
+            return True
+
+    def replay(self, handler, available=lambda: True):
+        """Hands buffered items to `handler` in order until one hits an open breaker."""
+        replayed = 0
+        while available():
+            with self._lock:
+                if not self._items:
+                    break
+                item = self._items[0]
+            try:
+                handler(item)
+            except CircuitOpenError:
+                break
+            except Exception as e:
+                if not available():
+                    # The dependency went down again mid-replay; keep the item
+                    break
+                # A poison item must not block everything queued behind it
+                print(f"[-] Dropping buffered item after replay error: {e}")
+                with self._lock:
+                    self._items.popleft()
+                    self._dropped += 1
+                continue
+            with self._lock:
+                self._items.popleft()
+                self._replayed += 1
+            replayed += 1
+        return replayed
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "buffered": len(self._items),
+                "capacity": self.maxlen,
+                "dropped": self._dropped,
+                "replayed": self._replayed,
+            }
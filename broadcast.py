@@ -0,0 +1,140 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+from breaker import CircuitOpenError
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per `per` seconds, shared between threads."""
+
+    def __init__(self, rate, per=1.0, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.per = per
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(rate)
+        self._updated = clock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.per)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.per / self.rate
+            self.sleep(wait)
+
+
+def call_with_retry(fn, attempts=5, sleep=time.sleep):
+    """Calls `fn`, waiting out Telegram flood limits and open breakers between attempts."""
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except ApiTelegramException as e:
+            if e.error_code != 429 or attempt == attempts - 1:
+                raise
+            sleep((e.result_json or {}).get("parameters", {}).get("retry_after", 1))
+        except CircuitOpenError as e:
+            if attempt == attempts - 1:
+                raise
+            sleep(max(e.retry_after, 1))
+
+
+class BulkJob:
+    """Streams targets in batches and fans work out under a rate limit.
+
+    `fetch_batch(cursor)` returns (items, next_cursor); an empty batch ends
+    the job. `handle(item)` does the work for one target and returns
+    whether it succeeded. `checkpoint(job)` runs after every batch so an
+    interrupted job can be resumed from `cursor`. Progress is only saved
+    between batches, so a job resumed after a crash repeats the work of up
+    to one batch, e.g. resends up to a batch of broadcast messages.
+    """
+
+    def __init__(self, job_id, kind, fetch_batch, handle, checkpoint, cursor=None,
+                 processed=0, succeeded=0, failed=0, workers=4, on_progress=None):
+        self.job_id = job_id
+        self.kind = kind
+        self.fetch_batch = fetch_batch
+        self.handle = handle
+        self.checkpoint = checkpoint
+        self.cursor = cursor
+        self.processed = processed
+        self.succeeded = succeeded
+        self.failed = failed
+        self.workers = workers
+        self.on_progress = on_progress
+        self.status = "running"
+        self._cancelled = threading.Event()
+        self._started = None
+        self._processed_this_run = 0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _handle_one(self, item):
+        try:
+            return bool(self.handle(item))
+        except Exception as e:
+            print(f"[-] Job #{self.job_id} failed on {item}: {e}")
+            return False
+
+    @property
+    def throughput(self):
+        if not self._started:
+            return 0
+        elapsed = time.monotonic() - self._started
+        return self._processed_this_run / elapsed if elapsed > 0 else 0
+
+    def run(self):
+        self._started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                while not self._cancelled.is_set():
+                    items, next_cursor = call_with_retry(lambda: self.fetch_batch(self.cursor))
+                    if not items:
+                        self.status = "done"
+                        break
+
+                    results = list(pool.map(self._handle_one, items))
+                    self.succeeded += sum(results)
+                    self.failed += len(results) - sum(results)
+                    self.processed += len(results)
+                    self._processed_this_run += len(results)
+                    self.cursor = next_cursor
+
+                    self.checkpoint(self)
+                    if self.on_progress:
+                        self.on_progress(self)
+
+            if self._cancelled.is_set():
+                self.status = "cancelled"
+            self.checkpoint(self)
+        except Exception as e:
+            # The last checkpoint stays resumable
+            print(f"[-] Job #{self.job_id} interrupted: {e}")
+            self.status = "interrupted"
+            try:
+                self.checkpoint(self)
+            except Exception as checkpoint_error:
+                # Still "running" in storage; startup marks it interrupted then
+                print(f"[-] Job #{self.job_id} could not save its status: {checkpoint_error}")
+        if self.on_progress:
+            self.on_progress(self)
+
+    def metrics(self):
+        return {
+            "kind": self.kind,
+            "status": self.status,
+            "processed": self.processed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "per_second": round(self.throughput, 1),
+        }
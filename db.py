@@ -2,12 +2,14 @@ import os
 import json
 import time
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, TIMESTAMP, BigInteger, text
+from sqlalchemy import create_engine, Column, Integer, String, Text, TIMESTAMP, BigInteger, Index, text, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.exc import OperationalError, InterfaceError, DisconnectionError
 from contextlib import contextmanager
+from functools import wraps
+from breaker import CircuitBreaker
 
 Base = declarative_base()
 
@@ -15,9 +17,12 @@ class Help(Base):
     __tablename__ = 'helps'
     id = Column(Integer, primary_key=True)
     kitten_id = Column(Integer)
+    chat_id = Column(BigInteger)
     thread_id = Column(Integer, default=0)
     closed = Column(Integer, default=0)
     last_message_time = Column(TIMESTAMP)
+    # Every supporter message looks its session up by topic
+    __table_args__ = (Index('ix_helps_chat_thread', 'chat_id', 'thread_id'),)
 
 class Language(Base):
     __tablename__ = 'language'
@@ -29,15 +34,53 @@ class Log(Base):
     id = Column(Integer, primary_key=True)
     kitten_id = Column(Integer)
     supporters_ids = Column(Text)
+    chat_id = Column(BigInteger)
     forum_id = Column(Integer)
     messages = Column(Text)
 
+class Supporter(Base):
+    __tablename__ = 'supporters'
+    supporter_id = Column(BigInteger, primary_key=True)
+    sessions = Column(Text)
+    last_active = Column(TIMESTAMP)
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(64))
+    payload = Column(Text)
+    cursor = Column(BigInteger)
+    processed = Column(Integer, default=0)
+    succeeded = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    status = Column(String(32), default="running")
+    created_at = Column(TIMESTAMP)
+    updated_at = Column(TIMESTAMP)
+
+class Stat(Base):
+    __tablename__ = 'stats'
+    name = Column(String(64), primary_key=True)
+    data = Column(Text)
+
+def guarded(method):
+    # Route the call through the database circuit breaker so an outage fails fast
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.breaker.call(method, self, *args, **kwargs)
+    return wrapper
+
 class Database:
     def __init__(self):
+        self.breaker = CircuitBreaker(
+            "postgres",
+            failure_threshold=int(os.getenv("DB_BREAKER_THRESHOLD", "3")),
+            reset_timeout=float(os.getenv("DB_BREAKER_RESET", "15")),
+            # Bad data or queries are bugs, not outages, and must not open it
+            exceptions=(OperationalError, InterfaceError, DisconnectionError)
+        )
         self._init_db()
     
-    def _init_db(self):
-        max_retries = 5
+    def _init_db(self, max_retries=5):
         retry_count = 0
         
         while retry_count < max_retries:
@@ -45,9 +88,16 @@ class Database:
                 print(f"[*] Attempting PostgreSQL connection ({retry_count + 1}/{max_retries})...")
                 
                 db_url = f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@{os.getenv('POSTGRES_HOST')}/{os.getenv('POSTGRES_DB')}"
-                self.engine = create_engine(db_url)
+                # pool_pre_ping replaces connections that went stale while
+                # the database was away, so requests need no reconnect step
+                self.engine = create_engine(
+                    db_url,
+                    pool_pre_ping=True,
+                    connect_args={"connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5"))}
+                )
                 
                 Base.metadata.create_all(self.engine)
+                self._migrate()
                 self.Session = sessionmaker(bind=self.engine)
                 
                 print("[+] Database connection established successfully")
@@ -58,7 +108,25 @@ class Database:
                     print(f"[-] DB Connection failed: {e}. Retrying...")
                     time.sleep(5)
                 else:
-                    raise Exception(f"Failed to connect to PostgreSQL after multiple attempts")
+                    print(f"[-] Failed to connect to PostgreSQL after {max_retries} attempt(s)")
+                    if isinstance(e, OperationalError):
+                        raise
+                    # Kept an OperationalError so the breaker counts failed reconnects
+                    raise OperationalError(None, None, e) from e
+    
+    def _migrate(self):
+        # create_all does not add columns to existing tables
+        with self.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE helps ADD COLUMN IF NOT EXISTS chat_id BIGINT"))
+            conn.execute(text("ALTER TABLE logs ADD COLUMN IF NOT EXISTS chat_id BIGINT"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_helps_chat_thread ON helps (chat_id, thread_id)"))
+            if os.getenv("CHAT_ID"):
+                # Sessions and logs from before sharding all live in the primary forum
+                for table in ("helps", "logs"):
+                    conn.execute(
+                        text(f"UPDATE {table} SET chat_id = :chat_id WHERE chat_id IS NULL"),
+                        {"chat_id": int(os.getenv("CHAT_ID"))}
+                    )
     
     @contextmanager
     def session_scope(self):
@@ -73,21 +141,14 @@ class Database:
         finally:
             session.close()
     
-    def reconnect_if_needed(self):
-        try:
-            with self.session_scope() as session:
-                session.execute(text("SELECT 1"))
-        except (OperationalError, SQLAlchemyError):
-            self._init_db()
-    
+    @guarded
     def get_language(self, chat_id):
-        self.reconnect_if_needed()
         with self.session_scope() as session:
             result = session.query(Language).filter(Language.chat_id == chat_id).first()
             return result.lang if result else "English"
     
+    @guarded
     def set_language(self, chat_id, language):
-        self.reconnect_if_needed()
         with self.session_scope() as session:
             stmt = pg_insert(Language).values(chat_id=chat_id, lang=language)
             stmt = stmt.on_conflict_do_update(
@@ -96,21 +157,22 @@ class Database:
             )
             session.execute(stmt)
     
-    def get_help(self, kitten_id=None, thread_id=None) -> Help:
-        self.reconnect_if_needed()
+    @guarded
+    def get_help(self, kitten_id=None, chat_id=None, thread_id=None) -> Help:
         with self.session_scope() as session:
             result = None
             if kitten_id is not None:
                 result = session.query(Help).filter(Help.kitten_id == kitten_id).first()
             elif thread_id is not None:
-                result = session.query(Help).filter(Help.thread_id == thread_id).first()
+                # Thread ids are only unique within one forum
+                result = session.query(Help).filter(Help.chat_id == chat_id, Help.thread_id == thread_id).first()
             
             if result:
                 return {c.name: getattr(result, c.name) for c in result.__table__.columns}
             return None
     
+    @guarded
     def get_active_help(self, kitten_id):
-        self.reconnect_if_needed()
         with self.session_scope() as session:
             result = session.query(Help).filter(Help.kitten_id == kitten_id, Help.closed == 0).first()
             
@@ -118,10 +180,10 @@ class Database:
                 return {c.name: getattr(result, c.name) for c in result.__table__.columns}
             return None
     
-    def create_help(self, kitten_id):
-        self.reconnect_if_needed()
+    @guarded
+    def create_help(self, kitten_id, chat_id=None):
         with self.session_scope() as session:
-            new_help = Help(kitten_id=kitten_id, last_message_time=datetime.now())
+            new_help = Help(kitten_id=kitten_id, chat_id=chat_id, last_message_time=datetime.now())
             session.add(new_help)
             session.commit()
             
@@ -130,27 +192,41 @@ class Database:
                 return {c.name: getattr(help_obj, c.name) for c in help_obj.__table__.columns}
             return None
     
+    @guarded
+    def get_open_helps(self):
+        with self.session_scope() as session:
+            results = session.query(Help).filter(Help.closed == 0, Help.thread_id != 0).all()
+            return [{c.name: getattr(result, c.name) for c in result.__table__.columns} for result in results]
+    
+    @guarded
+    def count_open_helps(self):
+        with self.session_scope() as session:
+            rows = session.query(Help.chat_id, func.count(Help.id)).filter(Help.closed == 0).group_by(Help.chat_id).all()
+            return {chat_id: count for chat_id, count in rows}
+    
+    @guarded
     def update_thread_id(self, kitten_id, thread_id):
-        self.reconnect_if_needed()
         with self.session_scope() as session:
             session.query(Help).filter(Help.kitten_id == kitten_id).update({"thread_id": thread_id})
     
+    @guarded
     def update_last_message_time(self, kitten_id):
-        self.reconnect_if_needed()
         with self.session_scope() as session:
             session.query(Help).filter(Help.kitten_id == kitten_id).update({"last_message_time": datetime.now()})
     
+    @guarded
     def delete_help(self, kitten_id):
-        self.reconnect_if_needed()
         with self.session_scope() as session:
             session.query(Help).filter(Help.kitten_id == kitten_id).delete()
     
-    def log_message(self, kitten_id, forum_id, message, supporter_id=None):
-        self.reconnect_if_needed()
-        
+    @guarded
+    def log_message(self, kitten_id, forum_id, message, supporter_id=None, chat_id=None):
         try:
             with self.session_scope() as session:
-                log = session.query(Log).filter(Log.kitten_id == kitten_id, Log.forum_id == forum_id).first()
+                # forum_id is a thread id, which other forums can reuse
+                log = session.query(Log).filter(
+                    Log.kitten_id == kitten_id, Log.chat_id == chat_id, Log.forum_id == forum_id
+                ).first()
                 
                 if log:
                     try:
@@ -170,12 +246,123 @@ class Database:
                 else:
                     new_log = Log(
                         kitten_id=kitten_id,
+                        chat_id=chat_id,
                         forum_id=forum_id,
                         messages=json.dumps([message]),
                         supporters_ids=json.dumps([supporter_id] if supporter_id else [])
                     )
                     session.add(new_log)
             return True
+        except (OperationalError, InterfaceError, DisconnectionError):
+            # Let the breaker see outages
+            raise
         except Exception as e:
             print(f"[-] Logging error: {e}")
             return False
+
+    @guarded
+    def get_supporters(self):
+        with self.session_scope() as session:
+            rows = []
+            for supporter in session.query(Supporter).all():
+                try:
+                    sessions = json.loads(supporter.sessions or "{}")
+                except json.JSONDecodeError as e:
+                    print(f"[-] JSON decode error in supporter record: {e}")
+                    sessions = {}
+                rows.append({
+                    "supporter_id": supporter.supporter_id,
+                    "last_active": supporter.last_active.timestamp() if supporter.last_active else 0,
+                    "sessions": sessions
+                })
+            return rows
+    
+    @guarded
+    def save_supporters(self, rows):
+        if not rows:
+            return
+        with self.session_scope() as session:
+            values = [
+                dict(
+                    supporter_id=row["supporter_id"],
+                    sessions=json.dumps(row["sessions"]),
+                    last_active=datetime.fromtimestamp(row["last_active"])
+                )
+                for row in rows
+            ]
+            stmt = pg_insert(Supporter).values(values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['supporter_id'],
+                set_=dict(sessions=stmt.excluded.sessions, last_active=stmt.excluded.last_active)
+            )
+            session.execute(stmt)
+    
+    @guarded
+    def get_language_chat_ids(self, after=None, limit=100):
+        with self.session_scope() as session:
+            query = session.query(Language.chat_id)
+            if after is not None:
+                query = query.filter(Language.chat_id > after)
+            return [row.chat_id for row in query.order_by(Language.chat_id).limit(limit)]
+    
+    @guarded
+    def get_stale_helps(self, before, after=None, limit=100):
+        with self.session_scope() as session:
+            query = session.query(Help).filter(Help.last_message_time < before)
+            if after is not None:
+                query = query.filter(Help.id > after)
+            return [
+                {c.name: getattr(result, c.name) for c in result.__table__.columns}
+                for result in query.order_by(Help.id).limit(limit)
+            ]
+    
+    @guarded
+    def create_job(self, kind, payload):
+        with self.session_scope() as session:
+            job = Job(kind=kind, payload=json.dumps(payload), status="running",
+                      created_at=datetime.now(), updated_at=datetime.now())
+            session.add(job)
+            session.flush()
+            return {c.name: getattr(job, c.name) for c in job.__table__.columns}
+    
+    @guarded
+    def update_job(self, job_id, **fields):
+        with self.session_scope() as session:
+            fields["updated_at"] = datetime.now()
+            session.query(Job).filter(Job.id == job_id).update(fields)
+    
+    @guarded
+    def get_job(self, job_id):
+        with self.session_scope() as session:
+            job = session.query(Job).filter(Job.id == job_id).first()
+            if job:
+                return {c.name: getattr(job, c.name) for c in job.__table__.columns}
+            return None
+    
+    @guarded
+    def get_unfinished_jobs(self):
+        with self.session_scope() as session:
+            jobs = session.query(Job).filter(Job.status.in_(["running", "interrupted"])).order_by(Job.id).all()
+            return [{c.name: getattr(job, c.name) for c in job.__table__.columns} for job in jobs]
+    
+    @guarded
+    def get_stats(self, name="aggregates"):
+        with self.session_scope() as session:
+            result = session.query(Stat).filter(Stat.name == name).first()
+            if not result:
+                return {}
+            try:
+                return json.loads(result.data)
+            except json.JSONDecodeError as e:
+                print(f"[-] JSON decode error in stats record: {e}")
+                return {}
+    
+    @guarded
+    def save_stats(self, data, name="aggregates"):
+        with self.session_scope() as session:
+            stmt = pg_insert(Stat).values(name=name, data=json.dumps(data))
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['name'],
+                set_=dict(data=stmt.excluded.data)
+            )
+            session.execute(stmt)
@@ -0,0 +1,277 @@
+import heapq
+import threading
+import time
+import zlib
+from collections import deque
+
+
+class SupporterRouter:
+    """Assigns new help requests to the least-loaded active supporter.
+
+    Supporters become active when they reply in the forum and go inactive
+    after `active_window` seconds of silence. Candidates live in a min-heap
+    keyed on (open sessions, last assignment) so picking one is O(log n);
+    stale heap entries are skipped lazily instead of being removed.
+    Requests that arrive while nobody is active wait in a FIFO queue and
+    are handed out as soon as a supporter shows up.
+    """
+
+    def __init__(self, active_window=1800, wait_samples=500, clock=time.time):
+        self.active_window = active_window
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._heap = []
+        self._version = {}        # supporter_id -> version of its live heap entry
+        self._last_active = {}    # supporter_id -> timestamp of last reply
+        self._last_assigned = {}  # supporter_id -> assignment sequence number
+        self._sessions = {}       # supporter_id -> set of kitten_ids
+        self._assigned = {}       # kitten_id -> supporter_id
+        self._topics = {}         # kitten_id -> (chat_id, thread_id) of the forum topic
+        self._opened_at = {}      # kitten_id -> open time, until first supporter reply
+        self._waiting = deque()   # kitten_ids with no supporter yet
+        self._seq = 0
+        self._entry_seq = 0
+        self._waits = deque(maxlen=wait_samples)
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _is_active(self, supporter_id, now):
+        last_active = self._last_active.get(supporter_id)
+        return last_active is not None and now - last_active <= self.active_window
+
+    def _push(self, supporter_id):
+        self._entry_seq += 1
+        version = self._entry_seq
+        self._version[supporter_id] = version
+        entry = (len(self._sessions.get(supporter_id, ())), self._last_assigned.get(supporter_id, 0), supporter_id, version)
+        heapq.heappush(self._heap, entry)
+
+        # Drop stale entries once they outnumber the live ones
+        if len(self._heap) > 2 * len(self._version) + 64:
+            self._heap = [e for e in self._heap if self._version.get(e[2]) == e[3]]
+            heapq.heapify(self._heap)
+
+    def _pop_least_loaded(self, now):
+        while self._heap:
+            load, last_assigned, supporter_id, version = heapq.heappop(self._heap)
+            if self._version.get(supporter_id) != version:
+                continue
+            # Inactive supporters leave the heap until they reply again
+            del self._version[supporter_id]
+            if self._is_active(supporter_id, now):
+                return supporter_id
+        return None
+
+    def _assign_to(self, kitten_id, supporter_id):
+        self._seq += 1
+        self._last_assigned[supporter_id] = self._seq
+        self._sessions.setdefault(supporter_id, set()).add(kitten_id)
+        self._assigned[kitten_id] = supporter_id
+        self._push(supporter_id)
+
+    def _drain_waiting(self, now):
+        assignments = []
+        while self._waiting:
+            supporter_id = self._pop_least_loaded(now)
+            if supporter_id is None:
+                break
+            kitten_id = self._waiting.popleft()
+            self._assign_to(kitten_id, supporter_id)
+            assignments.append((kitten_id, self._topics.get(kitten_id), supporter_id))
+        return assignments
+
+    def open_session(self, kitten_id, topic):
+        """Registers a new help request and returns the assigned supporter id, or None if it was queued."""
+        with self._lock:
+            now = self.clock()
+            self._topics[kitten_id] = topic
+            self._opened_at[kitten_id] = now
+
+            supporter_id = self._pop_least_loaded(now)
+            if supporter_id is None:
+                self._waiting.append(kitten_id)
+                return None
+            self._assign_to(kitten_id, supporter_id)
+            return supporter_id
+
+    def record_reply(self, supporter_id, kitten_id=None):
+        """Marks a supporter as active after a reply.
+
+        Returns a list of (kitten_id, topic, supporter_id) for queued
+        requests that could be assigned now that the supporter is active.
+        """
+        with self._lock:
+            now = self.clock()
+            self._last_active[supporter_id] = now
+
+            if kitten_id is not None:
+                opened_at = self._opened_at.pop(kitten_id, None)
+                if opened_at is not None:
+                    self._record_wait(now - opened_at)
+
+                # Whoever answers a queued request first takes it
+                if kitten_id not in self._assigned and kitten_id in self._topics:
+                    try:
+                        self._waiting.remove(kitten_id)
+                    except ValueError:
+                        pass
+                    self._assign_to(kitten_id, supporter_id)
+
+            if self._version.get(supporter_id) is None:
+                self._push(supporter_id)
+            return self._drain_waiting(now)
+
+    def close_session(self, kitten_id):
+        with self._lock:
+            self._topics.pop(kitten_id, None)
+            self._opened_at.pop(kitten_id, None)
+            try:
+                self._waiting.remove(kitten_id)
+            except ValueError:
+                pass
+
+            supporter_id = self._assigned.pop(kitten_id, None)
+            if supporter_id is None:
+                return
+            self._sessions.get(supporter_id, set()).discard(kitten_id)
+            if self._version.get(supporter_id) is not None:
+                self._push(supporter_id)
+
+    def get_supporter(self, kitten_id):
+        with self._lock:
+            return self._assigned.get(kitten_id)
+
+    def _record_wait(self, seconds):
+        self._waits.append(seconds)
+        self._wait_count += 1
+        self._wait_total += seconds
+        self._wait_max = max(self._wait_max, seconds)
+
+    def metrics(self):
+        with self._lock:
+            now = self.clock()
+            waits = sorted(self._waits)
+            oldest_waiting = min((self._opened_at[k] for k in self._waiting if k in self._opened_at), default=None)
+            return {
+                "active_supporters": sum(1 for s in self._last_active if self._is_active(s, now)),
+                "open_sessions": len(self._topics),
+                "assigned_sessions": len(self._assigned),
+                "queued_sessions": len(self._waiting),
+                "oldest_queued_seconds": round(now - oldest_waiting, 1) if oldest_waiting is not None else 0,
+                "queue_wait": {
+                    "count": self._wait_count,
+                    "avg_seconds": round(self._wait_total / self._wait_count, 1) if self._wait_count else 0,
+                    "max_seconds": round(self._wait_max, 1),
+                    "p50_seconds": round(waits[len(waits) // 2], 1) if waits else 0,
+                    "p90_seconds": round(waits[int(len(waits) * 0.9)], 1) if waits else 0,
+                },
+            }
+
+    def snapshot(self):
+        """Returns supporter state as rows for `Database.save_supporters`."""
+        with self._lock:
+            rows = []
+            for supporter_id, last_active in self._last_active.items():
+                sessions = {k: self._topics.get(k) for k in self._sessions.get(supporter_id, ())}
+                rows.append({"supporter_id": supporter_id, "last_active": last_active, "sessions": sessions})
+            return rows
+
+    def restore(self, rows):
+        """Loads rows previously produced by `snapshot`."""
+        with self._lock:
+            now = self.clock()
+            for row in rows:
+                supporter_id = row["supporter_id"]
+                self._last_active[supporter_id] = row["last_active"]
+                for kitten_id, topic in row["sessions"].items():
+                    kitten_id = int(kitten_id)
+                    # Older snapshots stored the bare thread id of the primary forum
+                    self._topics[kitten_id] = tuple(topic) if isinstance(topic, (list, tuple)) else (None, topic)
+                    self._sessions.setdefault(supporter_id, set()).add(kitten_id)
+                    self._assigned[kitten_id] = supporter_id
+                if self._is_active(supporter_id, now):
+                    self._push(supporter_id)
+
+    def reconcile(self, open_topics):
+        """Aligns restored state with the sessions that are actually open.
+
+        `open_topics` maps kitten_id -> (chat_id, thread_id) for every open
+        help. Restored sessions missing from it are dropped, and open
+        sessions without a supporter are queued again, since snapshots are
+        periodic and never include the queue.
+        """
+        with self._lock:
+            now = self.clock()
+            for kitten_id in [k for k in self._topics if k not in open_topics]:
+                self._topics.pop(kitten_id)
+                self._opened_at.pop(kitten_id, None)
+                supporter_id = self._assigned.pop(kitten_id, None)
+                if supporter_id is not None:
+                    self._sessions.get(supporter_id, set()).discard(kitten_id)
+
+            queued = set(self._waiting)
+            for kitten_id, topic in open_topics.items():
+                self._topics[kitten_id] = topic
+                if kitten_id not in self._assigned and kitten_id not in queued:
+                    self._waiting.append(kitten_id)
+
+            # Loads changed, so rebuild the heap from scratch
+            self._heap = []
+            self._version = {}
+            for supporter_id in self._last_active:
+                if self._is_active(supporter_id, now):
+                    self._push(supporter_id)
+            return self._drain_waiting(now)
+
+
+class ForumShards:
+    """Spreads new sessions across several support forums.
+
+    With the "hash" strategy a kitten always lands in the same forum; with
+    "load" the forum with the fewest open sessions is picked.
+    """
+
+    def __init__(self, chat_ids, strategy="hash"):
+        if not chat_ids:
+            raise ValueError("At least one support chat is required")
+        if strategy not in ("hash", "load"):
+            raise ValueError(f"Unknown shard strategy: {strategy}")
+        self.chat_ids = list(chat_ids)
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._open = {chat_id: 0 for chat_id in self.chat_ids}
+
+    def __contains__(self, chat_id):
+        return chat_id in self._open
+
+    @property
+    def primary(self):
+        return self.chat_ids[0]
+
+    def pick(self, kitten_id):
+        """Picks a forum and reserves a session in it; call `closed` if it is never opened."""
+        with self._lock:
+            if self.strategy == "hash":
+                chat_id = self.chat_ids[zlib.crc32(str(kitten_id).encode()) % len(self.chat_ids)]
+            else:
+                chat_id = min(self.chat_ids, key=lambda chat_id: self._open[chat_id])
+            # Counted right away so concurrent picks see each other
+            self._open[chat_id] += 1
+            return chat_id
+
+    def closed(self, chat_id):
+        with self._lock:
+            if self._open.get(chat_id, 0) > 0:
+                self._open[chat_id] -= 1
+
+    def restore(self, counts):
+        """Seeds open-session counts, e.g. from `Database.count_open_helps`."""
+        with self._lock:
+            for chat_id, count in counts.items():
+                if chat_id in self._open:
+                    self._open[chat_id] = count
+
+    def metrics(self):
+        with self._lock:
+            return {"strategy": self.strategy, "open_sessions": {str(k): v for k, v in self._open.items()}}
@@ -0,0 +1,148 @@
+import threading
+import time
+
+
+class Stats:
+    """Operational aggregates updated as events happen.
+
+    Every event touches a handful of counters, and `snapshot` is rebuilt
+    only after something changed, so serving it costs the same no matter
+    how many sessions or messages there have been.
+    """
+
+    def __init__(self, hours=24, clock=time.time):
+        self.hours = hours
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._hourly = {}          # hour number -> [opened, closed]
+        self._open = {}            # kitten_id -> [opened_at, messages, first reply seen, supporter ids]
+        self._opened = 0
+        self._closed = 0
+        self._first_reply_count = 0
+        self._first_reply_total = 0.0
+        self._first_reply_max = 0.0
+        self._messages = 0
+        self._closed_sessions = 0   # closed sessions whose messages were counted
+        self._closed_messages = 0
+        self._max_messages = 0
+        self._supporters = {}      # supporter_id -> [replies, sessions]
+        self._snapshot = None
+        self._snapshot_hour = None
+
+    def _bucket(self, now):
+        hour = int(now // 3600)
+        bucket = self._hourly.get(hour)
+        if bucket is None:
+            bucket = self._hourly[hour] = [0, 0]
+            for old in [h for h in self._hourly if h <= hour - self.hours]:
+                del self._hourly[old]
+        return bucket
+
+    def session_opened(self, kitten_id):
+        with self._lock:
+            now = self.clock()
+            self._bucket(now)[0] += 1
+            self._opened += 1
+            self._open[kitten_id] = [now, 0, False, set()]
+            self._snapshot = None
+
+    def session_closed(self, kitten_id):
+        with self._lock:
+            self._bucket(self.clock())[1] += 1
+            self._closed += 1
+            session = self._open.pop(kitten_id, None)
+            if session is not None:
+                self._closed_sessions += 1
+                self._closed_messages += session[1]
+                self._max_messages = max(self._max_messages, session[1])
+            self._snapshot = None
+
+    def message(self, kitten_id, supporter_id=None):
+        with self._lock:
+            now = self.clock()
+            self._messages += 1
+            session = self._open.get(kitten_id)
+            if session is not None:
+                session[1] += 1
+
+            if supporter_id is not None:
+                counts = self._supporters.setdefault(supporter_id, [0, 0])
+                counts[0] += 1
+                if session is not None:
+                    if supporter_id not in session[3]:
+                        session[3].add(supporter_id)
+                        counts[1] += 1
+                    if not session[2]:
+                        session[2] = True
+                        waited = now - session[0]
+                        self._first_reply_count += 1
+                        self._first_reply_total += waited
+                        self._first_reply_max = max(self._first_reply_max, waited)
+            self._snapshot = None
+
+    def snapshot(self):
+        with self._lock:
+            current = int(self.clock() // 3600)
+            # The hourly window moves even when nothing happens
+            if self._snapshot is None or self._snapshot_hour != current:
+                self._snapshot_hour = current
+                per_hour = []
+                for hour in range(current - self.hours + 1, current + 1):
+                    opened, closed = self._hourly.get(hour, (0, 0))
+                    per_hour.append({
+                        "hour": time.strftime("%Y-%m-%d %H:00", time.localtime(hour * 3600)),
+                        "opened": opened,
+                        "closed": closed,
+                    })
+                self._snapshot = {
+                    "sessions": {
+                        "opened": self._opened,
+                        "closed": self._closed,
+                        "per_hour": per_hour,
+                    },
+                    "first_reply": {
+                        "count": self._first_reply_count,
+                        "avg_seconds": round(self._first_reply_total / self._first_reply_count, 1) if self._first_reply_count else 0,
+                        "max_seconds": round(self._first_reply_max, 1),
+                    },
+                    "messages": {
+                        "total": self._messages,
+                        "per_session_avg": round(self._closed_messages / self._closed_sessions, 1) if self._closed_sessions else 0,
+                        "per_session_max": self._max_messages,
+                    },
+                    "supporters": {
+                        str(supporter_id): {"replies": replies, "sessions": sessions}
+                        for supporter_id, (replies, sessions) in self._supporters.items()
+                    },
+                }
+            return self._snapshot
+
+    def dump(self):
+        """Returns the counters for `Database.save_stats`, including sessions still open."""
+        with self._lock:
+            return {
+                "hourly": {str(hour): list(bucket) for hour, bucket in self._hourly.items()},
+                "opened": self._opened,
+                "closed": self._closed,
+                "first_reply": [self._first_reply_count, self._first_reply_total, self._first_reply_max],
+                "messages": [self._messages, self._closed_sessions, self._closed_messages, self._max_messages],
+                "supporters": {str(supporter_id): list(counts) for supporter_id, counts in self._supporters.items()},
+                "open": {
+                    str(kitten_id): [opened_at, messages, replied, sorted(supporters)]
+                    for kitten_id, (opened_at, messages, replied, supporters) in self._open.items()
+                },
+            }
+
+    def load(self, data):
+        with self._lock:
+            self._hourly = {int(hour): list(bucket) for hour, bucket in data.get("hourly", {}).items()}
+            self._opened = data.get("opened", 0)
+            self._closed = data.get("closed", 0)
+            self._first_reply_count, self._first_reply_total, self._first_reply_max = data.get("first_reply", [0, 0.0, 0.0])
+            self._messages, self._closed_sessions, self._closed_messages, self._max_messages = data.get("messages", [0, 0, 0, 0])
+            self._supporters = {int(supporter_id): list(counts) for supporter_id, counts in data.get("supporters", {}).items()}
+            self._open = {
+                int(kitten_id): [opened_at, messages, replied, set(supporters)]
+                for kitten_id, (opened_at, messages, replied, supporters) in data.get("open", {}).items()
+            }
+            self._snapshot = None
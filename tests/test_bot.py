@@ -24,6 +24,7 @@ def setup_db(monkeypatch):
         def __init__(self):
             self.lang = {}
             self.helps = {}
+            self.logs = []
             self.help_counter = 1
 
         def get_language(self, chat_id):
@@ -32,13 +33,18 @@ def setup_db(monkeypatch):
         def set_language(self, chat_id, language):
             self.lang[chat_id] = language
 
-        def get_help(self, kitten_id=None, thread_id=None):
+        def get_help(self, kitten_id=None, chat_id=None, thread_id=None):
             if kitten_id is not None:
                 return self.helps.get(kitten_id)
+            if thread_id is not None:
+                return next((h for h in self.helps.values() if h["chat_id"] == chat_id and h["thread_id"] == thread_id), None)
             return None
 
-        def create_help(self, kitten_id):
-            help_obj = {"id": self.help_counter, "kitten_id": kitten_id, "thread_id": 0, "closed": 0, "last_message_time": "2025-03-11 09:00:00.000000"}
+        def get_active_help(self, kitten_id):
+            return self.helps.get(kitten_id)
+
+        def create_help(self, kitten_id, chat_id=None):
+            help_obj = {"id": self.help_counter, "kitten_id": kitten_id, "chat_id": chat_id, "thread_id": 0, "closed": 0, "last_message_time": "2025-03-11 09:00:00.000000"}
             self.helps[kitten_id] = help_obj
             self.help_counter += 1
             return help_obj
@@ -55,7 +61,8 @@ def setup_db(monkeypatch):
             if kitten_id in self.helps:
                 del self.helps[kitten_id]
 
-        def log_message(self, kitten_id, forum_id, message, supporter_id=None):
+        def log_message(self, kitten_id, forum_id, message, supporter_id=None, chat_id=None):
+            self.logs.append((kitten_id, chat_id, forum_id, message))
             return True
 
     dummy_db = DummyDB()
@@ -117,10 +124,10 @@ def test_help_command_no_request(capture_messages):
 
 def test_help_command_with_request(monkeypatch, capture_messages):
     # Ensure get_help returns None (no open help)
-    monkeypatch.setattr(bot.db, "get_help", lambda kitten_id=None, thread_id=None: None)
+    monkeypatch.setattr(bot.db, "get_help", lambda kitten_id=None, chat_id=None, thread_id=None: None)
 
-    def fake_create_help(kitten_id):
-        return {"id": 1, "kitten_id": kitten_id, "thread_id": 111, "closed": 0, "last_message_time": "2025-03-11 09:00:00.000000"}
+    def fake_create_help(kitten_id, chat_id=None):
+        return {"id": 1, "kitten_id": kitten_id, "chat_id": chat_id, "thread_id": 111, "closed": 0, "last_message_time": "2025-03-11 09:00:00.000000"}
     monkeypatch.setattr(bot.db, "create_help", fake_create_help)
     
     msg = DummyMessage(chat_id=4, text="/help This is a test help message")
@@ -153,3 +160,164 @@ def test_report_error(monkeypatch, capture_messages):
     
     # Check that an error message was sent to the admin (ADMIN_CHAT_ID should be an int)
     assert any(isinstance(m["chat_id"], int) for m in capture_messages)
+
+
+def test_messages_buffered_while_degraded(monkeypatch):
+    monkeypatch.setattr(bot, "message_buffer", bot.ReplayBuffer(maxlen=10))
+    monkeypatch.setattr(bot, "dependencies_available", lambda: False)
+
+    first = DummyMessage(chat_id=5, text="first")
+    second = DummyMessage(chat_id=5, text="second")
+    bot.handle_messages(first)
+    bot.handle_messages(second)
+    assert len(bot.message_buffer) == 2
+
+    processed = []
+    bot.message_buffer.replay(lambda message: processed.append(message.text))
+    assert processed == ["first", "second"]
+
+
+def test_stats_endpoint(monkeypatch):
+    monkeypatch.setattr(bot, "METRICS_TOKEN", "secret")
+    client = bot.app.test_client()
+    assert client.get("/stats").status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+
+    bot.stats.message(9, supporter_id=424242)
+    response = client.get("/stats", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert "first_reply" in response.get_json()
+    assert "424242" not in response.get_data(as_text=True)
+
+
+def test_message_not_replayed_when_logging_fails(monkeypatch):
+    sent = []
+    monkeypatch.setattr(bot, "message_buffer", bot.ReplayBuffer(maxlen=10))
+    monkeypatch.setattr(bot, "dependencies_available", lambda: True)
+    monkeypatch.setattr(bot.bot, "send_message", lambda *args, **kwargs: sent.append(kwargs.get("text")))
+
+    def breaker_open(*args, **kwargs):
+        raise bot.CircuitOpenError("postgres", 5)
+    monkeypatch.setattr(bot.db, "log_message", breaker_open)
+    monkeypatch.setattr(bot.db, "update_last_message_time", breaker_open)
+
+    msg = DummyMessage(chat_id=6, text="hello")
+    msg.content_type = "text"
+    msg.date = 1741683600
+    msg.message_thread_id = None
+    monkeypatch.setattr(bot.db, "get_help", lambda kitten_id=None, chat_id=None, thread_id=None: {
+        "id": 1, "kitten_id": 6, "chat_id": None, "thread_id": 77, "closed": 0, "last_message_time": None
+    })
+
+    messages_before = bot.stats.snapshot()["messages"]["total"]
+    bot.handle_messages(msg)
+    bot.message_buffer.replay(bot.process_message)
+    assert sent == ["hello"]
+    assert len(bot.message_buffer) == 0
+    assert bot.stats.snapshot()["messages"]["total"] == messages_before + 1
+
+
+def test_help_command_with_breaker_open(monkeypatch, capture_messages):
+    def breaker_open(*args, **kwargs):
+        raise bot.CircuitOpenError("postgres", 5)
+    monkeypatch.setattr(bot.db, "get_help", breaker_open)
+    monkeypatch.setattr(bot.db, "get_language", breaker_open)
+
+    msg = DummyMessage(chat_id=7, text="/help I need to talk")
+    bot.help_command(msg)
+
+    assert [m["chat_id"] for m in capture_messages] == [7]
+    assert "temporarily unavailable" in capture_messages[0]["text"]
+
+
+def test_interrupted_broadcast_waits_for_admin(monkeypatch, capture_messages):
+    started = []
+    updates = []
+    monkeypatch.setattr(bot, "start_job", lambda job_row: started.append(job_row['id']))
+    monkeypatch.setattr(bot.db, "update_job", lambda job_id, **fields: updates.append((job_id, fields)), raising=False)
+    monkeypatch.setattr(bot.db, "get_unfinished_jobs", lambda: [
+        {"id": 1, "kind": "broadcast", "status": "running", "processed": 200},
+        {"id": 2, "kind": "close_stale", "status": "running", "processed": 0},
+        {"id": 3, "kind": "close_stale", "status": "interrupted", "processed": 50},
+    ], raising=False)
+
+    bot.resume_unfinished_jobs()
+
+    assert started == [2]
+    assert updates == [(1, {"status": "interrupted"})]
+    assert ["/resume_job 1" in m["text"] for m in capture_messages] == [True, False]
+    assert "/resume_job 3" in capture_messages[1]["text"]
+
+
+def test_db_breaker_ignores_data_errors():
+    from sqlalchemy.exc import DataError
+
+    def out_of_range():
+        raise DataError("INSERT INTO helps", {}, ValueError("integer out of range"))
+
+    for _ in range(bot.db_breaker.failure_threshold + 1):
+        with pytest.raises(DataError):
+            bot.db_breaker.call(out_of_range)
+    assert bot.db_breaker.state == "closed"
+
+
+def test_broadcast_rejected_when_preview_fails(monkeypatch, capture_messages):
+    from telebot.apihelper import ApiTelegramException
+
+    def fake_send_message(chat_id, text, **kwargs):
+        if text == "Maintenance at <5pm":
+            raise ApiTelegramException("sendMessage", None, {
+                "error_code": 400, "description": "Bad Request: can't parse entities"
+            })
+        capture_messages.append({"chat_id": chat_id, "text": text})
+    monkeypatch.setattr(bot.bot, "send_message", fake_send_message)
+    monkeypatch.setattr(bot.db, "create_job", lambda kind, payload: pytest.fail("job created"), raising=False)
+
+    bot.broadcast_command(DummyMessage(chat_id=bot.ADMIN_CHAT_ID, text="/broadcast Maintenance at <5pm"))
+
+    assert len(capture_messages) == 1
+    assert "can't parse entities" in capture_messages[0]["text"]
+
+
+def test_session_in_secondary_forum(monkeypatch):
+    sent = []
+    topics = []
+    closed_topics = []
+    monkeypatch.setattr(bot, "shards", bot.ForumShards([-100, -200], strategy="load"))
+    monkeypatch.setattr(bot, "router", bot.SupporterRouter())
+    monkeypatch.setattr(bot, "message_buffer", bot.ReplayBuffer(maxlen=10))
+    monkeypatch.setattr(bot, "dependencies_available", lambda: True)
+    monkeypatch.setattr(bot.bot, "send_message", lambda chat_id, text, **kwargs: sent.append((chat_id, text)))
+    monkeypatch.setattr(bot.bot, "close_forum_topic", lambda chat_id, thread_id: closed_topics.append((chat_id, thread_id)))
+
+    def fake_create_forum_topic(chat_id, name):
+        topics.append(chat_id)
+        return type('Topic', (), {"message_thread_id": 555})
+    monkeypatch.setattr(bot.bot, "create_forum_topic", fake_create_forum_topic)
+
+    # The primary forum is busier, so the session lands in the second one
+    bot.shards.restore({-100: 5})
+    bot.help_command(DummyMessage(chat_id=8, text="/help I need to talk"))
+    assert topics == [-200]
+    assert bot.db.helps[8]["chat_id"] == -200
+
+    def supporter_reply(chat_id, text):
+        reply = DummyMessage(chat_id=chat_id, text=text)
+        reply.from_user = type('User', (), {"id": 42})
+        reply.content_type = "text"
+        reply.date = 1741683600
+        reply.message_thread_id = 555
+        return reply
+
+    # The same thread id in the primary forum belongs to nobody
+    sent.clear()
+    bot.handle_messages(supporter_reply(-100, "wrong forum"))
+    assert not any(chat_id == 8 for chat_id, _ in sent)
+
+    bot.handle_messages(supporter_reply(-200, "I am here"))
+    assert [text for chat_id, text in sent if chat_id == 8][-1].endswith("I am here")
+    assert bot.db.logs[-1] == (8, -200, 555, "I am here")
+
+    bot.close_command(DummyMessage(chat_id=8, text="/close"))
+    assert closed_topics == [(-200, 555)]
+    assert 8 not in bot.db.helps
@@ -0,0 +1,68 @@
+import pytest
+from breaker import CircuitBreaker, CircuitOpenError, ReplayBuffer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def failing():
+    raise ConnectionError("down")
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("db", failure_threshold=2, reset_timeout=10, clock=FakeClock())
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(failing)
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+    assert breaker.metrics()["rejected_calls"] == 1
+
+
+def test_breaker_half_open_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker("db", failure_threshold=1, reset_timeout=10, clock=clock)
+    with pytest.raises(ConnectionError):
+        breaker.call(failing)
+
+    clock.now += 10
+    assert breaker.state == "half_open"
+
+    # A failed probe reopens the breaker for another full timeout
+    with pytest.raises(ConnectionError):
+        breaker.call(failing)
+    assert breaker.state == "open"
+    assert not breaker.available
+
+    clock.now += 10
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_replay_buffer_keeps_order_and_bounds():
+    buffer = ReplayBuffer(maxlen=3)
+    for item in range(4):
+        buffer.add(item)
+    assert buffer.metrics()["dropped"] == 1
+
+    handled = []
+
+    def handler(item):
+        if item == 2 and not handled.count("retried"):
+            handled.append("retried")
+            raise CircuitOpenError("api")
+        handled.append(item)
+
+    assert buffer.replay(handler) == 2
+    assert len(buffer) == 1
+
+    assert buffer.replay(handler) == 1
+    assert handled == [0, 1, "retried", 2]
+    assert len(buffer) == 0
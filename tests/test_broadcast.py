@@ -0,0 +1,98 @@
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from broadcast import RateLimiter, BulkJob, call_with_retry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_rate_limiter_spaces_calls():
+    clock = FakeClock()
+    limiter = RateLimiter(2, per=1.0, clock=clock, sleep=clock.sleep)
+
+    # The bucket starts full, then refills at two tokens per second
+    for _ in range(6):
+        limiter.acquire()
+    assert clock.now == pytest.approx(1002.0)
+
+
+def test_call_with_retry_waits_out_flood_limit():
+    waits = []
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ApiTelegramException("sendMessage", None, {
+                "error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": 7}
+            })
+        return "sent"
+
+    assert call_with_retry(flaky, sleep=waits.append) == "sent"
+    assert waits == [7]
+
+
+def test_call_with_retry_raises_other_errors():
+    def blocked():
+        raise ApiTelegramException("sendMessage", None, {"error_code": 403, "description": "Forbidden"})
+
+    with pytest.raises(ApiTelegramException):
+        call_with_retry(blocked, sleep=lambda seconds: None)
+
+
+def run_job(targets, cursor=None, fail_on=()):
+    checkpoints = []
+    handled = []
+
+    def fetch_batch(cursor):
+        batch = [t for t in targets if cursor is None or t > cursor][:2]
+        return batch, batch[-1] if batch else cursor
+
+    def handle(target):
+        if target in fail_on:
+            raise RuntimeError("blocked")
+        handled.append(target)
+        return True
+
+    job = BulkJob(1, "broadcast", fetch_batch, handle, lambda job: checkpoints.append(job.cursor), cursor=cursor, workers=2)
+    job.run()
+    return job, handled, checkpoints
+
+
+def test_bulk_job_streams_batches_and_checkpoints():
+    job, handled, checkpoints = run_job([1, 2, 3, 4, 5], fail_on=(4,))
+
+    assert job.status == "done"
+    assert sorted(handled) == [1, 2, 3, 5]
+    assert (job.processed, job.succeeded, job.failed) == (5, 4, 1)
+    assert checkpoints == [2, 4, 5, 5]
+
+
+def test_bulk_job_resumes_from_cursor():
+    job, handled, _ = run_job([1, 2, 3, 4, 5], cursor=3)
+    assert sorted(handled) == [4, 5]
+    assert job.processed == 2
+
+
+def test_bulk_job_saves_interrupted_status():
+    statuses = []
+
+    def fetch_batch(cursor):
+        if cursor is not None:
+            raise RuntimeError("database is down")
+        return [1, 2], 2
+
+    job = BulkJob(1, "broadcast", fetch_batch, lambda target: True,
+                  lambda job: statuses.append((job.cursor, job.status)), workers=2)
+    job.run()
+    assert job.status == "interrupted"
+    assert statuses == [(2, "running"), (2, "interrupted")]
@@ -0,0 +1,116 @@
+from routing import SupporterRouter, ForumShards
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_assigns_least_loaded_supporter():
+    router = SupporterRouter()
+    router.record_reply(1)
+    router.record_reply(2)
+
+    first = router.open_session(100, (-100, 10))
+    second = router.open_session(101, (-100, 11))
+    assert {first, second} == {1, 2}
+
+    # Closing a session frees that supporter up for the next request
+    router.close_session(100)
+    assert router.open_session(102, (-100, 12)) == first
+
+
+def test_queues_until_supporter_is_active():
+    clock = FakeClock()
+    router = SupporterRouter(clock=clock)
+
+    assert router.open_session(100, (-100, 10)) is None
+    assert router.metrics()["queued_sessions"] == 1
+
+    clock.now += 30
+    assignments = router.record_reply(7)
+    assert assignments == [(100, (-100, 10), 7)]
+    assert router.get_supporter(100) == 7
+    assert router.metrics()["queued_sessions"] == 0
+
+
+def test_inactive_supporters_are_skipped():
+    clock = FakeClock()
+    router = SupporterRouter(active_window=60, clock=clock)
+    router.record_reply(1)
+
+    clock.now += 120
+    assert router.open_session(100, (-100, 10)) is None
+
+
+def test_queue_wait_metrics():
+    clock = FakeClock()
+    router = SupporterRouter(clock=clock)
+    router.open_session(100, (-100, 10))
+
+    clock.now += 45
+    router.record_reply(3, kitten_id=100)
+
+    queue_wait = router.metrics()["queue_wait"]
+    assert queue_wait["count"] == 1
+    assert queue_wait["max_seconds"] == 45
+    assert router.get_supporter(100) == 3
+
+
+def test_snapshot_restore():
+    router = SupporterRouter()
+    router.record_reply(1)
+    router.open_session(100, (-100, 10))
+
+    restored = SupporterRouter()
+    restored.restore(router.snapshot())
+    assert restored.get_supporter(100) == 1
+    assert restored.open_session(101, (-100, 11)) == 1
+
+
+def test_restore_old_snapshot_format():
+    restored = SupporterRouter()
+    restored.restore([{"supporter_id": 1, "last_active": restored.clock(), "sessions": {"100": 10}}])
+    assert restored.get_supporter(100) == 1
+    assert restored.snapshot()[0]["sessions"] == {100: (None, 10)}
+
+
+def test_hash_sharding_is_stable():
+    shards = ForumShards([-1, -2, -3])
+    assert shards.pick(42) == shards.pick(42)
+    assert {shards.pick(kitten_id) for kitten_id in range(100)} == {-1, -2, -3}
+    assert -2 in shards and 5 not in shards
+
+
+def test_load_sharding_picks_emptiest_forum():
+    shards = ForumShards([-1, -2], strategy="load")
+    shards.restore({-1: 3, -2: 1})
+    assert shards.pick(42) == -2
+
+    # Each pick reserves a slot, so back-to-back picks spread out
+    assert shards.pick(43) == -2
+    shards.closed(-1)
+    assert shards.pick(44) == -1
+
+    # A pick that never turns into a session is given back
+    shards.closed(-1)
+    assert shards.metrics()["open_sessions"] == {"-1": 2, "-2": 3}
+
+
+def test_reconcile_with_open_helps():
+    router = SupporterRouter()
+    router.record_reply(1)
+    router.open_session(100, (-100, 10))
+    router.open_session(101, (-100, 11))
+
+    restored = SupporterRouter()
+    restored.restore(router.snapshot())
+    # 100 was closed after the last snapshot, 102 was still waiting for a supporter
+    assignments = restored.reconcile({101: (-100, 11), 102: (-100, 12)})
+
+    assert restored.get_supporter(100) is None
+    assert assignments == [(102, (-100, 12), 1)]
+    assert restored.metrics()["open_sessions"] == 2
@@ -0,0 +1,87 @@
+import json
+
+from stats import Stats
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100 * 3600.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_session_and_message_aggregates():
+    clock = FakeClock()
+    stats = Stats(clock=clock)
+
+    stats.session_opened(1)
+    stats.message(1)
+    clock.now += 90
+    stats.message(1, supporter_id=7)
+    stats.message(1, supporter_id=7)
+    stats.message(1, supporter_id=8)
+    stats.session_closed(1)
+
+    snapshot = stats.snapshot()
+    assert snapshot["sessions"]["opened"] == 1
+    assert snapshot["sessions"]["closed"] == 1
+    assert snapshot["sessions"]["per_hour"][-1]["opened"] == 1
+    assert snapshot["first_reply"] == {"count": 1, "avg_seconds": 90, "max_seconds": 90}
+    assert snapshot["messages"] == {"total": 4, "per_session_avg": 4, "per_session_max": 4}
+    assert snapshot["supporters"] == {"7": {"replies": 2, "sessions": 1}, "8": {"replies": 1, "sessions": 1}}
+
+
+def test_snapshot_is_cached_until_something_changes():
+    clock = FakeClock()
+    stats = Stats(clock=clock)
+    first = stats.snapshot()
+    assert stats.snapshot() is first
+
+    stats.session_opened(1)
+    assert stats.snapshot() is not first
+
+
+def test_hourly_window_moves():
+    clock = FakeClock()
+    stats = Stats(hours=3, clock=clock)
+    stats.session_opened(1)
+    assert stats.snapshot()["sessions"]["per_hour"][-1]["opened"] == 1
+
+    clock.now += 3600
+    per_hour = stats.snapshot()["sessions"]["per_hour"]
+    assert len(per_hour) == 3
+    assert [hour["opened"] for hour in per_hour] == [0, 1, 0]
+
+
+def test_dump_and_load():
+    stats = Stats()
+    stats.session_opened(1)
+    stats.message(1, supporter_id=7)
+    stats.session_closed(1)
+
+    restored = Stats()
+    restored.load(stats.dump())
+    assert restored.snapshot()["sessions"] == stats.snapshot()["sessions"]
+    assert restored.snapshot()["supporters"] == {"7": {"replies": 1, "sessions": 1}}
+
+
+def test_dump_and_load_keeps_open_sessions():
+    clock = FakeClock()
+    stats = Stats(clock=clock)
+    stats.session_opened(1)
+    stats.message(1)
+    stats.message(1, supporter_id=7)
+
+    # Restart in the middle of the session
+    restored = Stats(clock=clock)
+    restored.load(json.loads(json.dumps(stats.dump())))
+    clock.now += 60
+    restored.message(1, supporter_id=7)
+    restored.message(1, supporter_id=8)
+    restored.session_closed(1)
+
+    snapshot = restored.snapshot()
+    assert snapshot["first_reply"]["count"] == 1
+    assert snapshot["messages"]["per_session_avg"] == 4
+    assert snapshot["supporters"] == {"7": {"replies": 2, "sessions": 1}, "8": {"replies": 1, "sessions": 1}}
@@ -0,0 +1,39 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+from bench_transport import FakeApiHandler
+from transport import BotTransport
+
+
+def test_transport_reuses_connections():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/bot123:test/sendMessage"
+
+    transport = BotTransport(pool_maxsize=2)
+    try:
+        for _ in range(5):
+            response = transport.request("post", url, params={"chat_id": 1, "text": "hi"})
+            assert response.json()["ok"]
+    finally:
+        transport.close()
+        server.shutdown()
+
+    metrics = transport.metrics()
+    assert metrics["requests"] == 5
+    assert metrics["connections_opened"] == 1
+    assert metrics["reuse_ratio"] == 0.8
+
+
+def test_http2_falls_back_without_httpx(monkeypatch):
+    import builtins
+    real_import = builtins.__import__
+
+    def fake_import(name, *args, **kwargs):
+        if name == "httpx":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", fake_import)
+    assert not BotTransport(http2=True).http2
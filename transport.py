@@ -0,0 +1,102 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class BotTransport:
+    """Keep-alive HTTP transport for Bot API calls.
+
+    Installed as telebot's custom request sender, so every call shares one
+    pooled session instead of the per-thread sessions telebot recycles.
+    With `http2=True` requests go through httpx when it is installed
+    (`pip install httpx[http2]`); otherwise the requests pool is used.
+    """
+
+    def __init__(self, pool_connections=2, pool_maxsize=8, pool_block=False,
+                 connect_timeout=5, read_timeout=15, http2=False, verify=True):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._http2_connections = 0
+        self._closed_connections = 0
+        self._client = None
+
+        if http2:
+            try:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    verify=verify,
+                    limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+                )
+            except ImportError:
+                print("[-] HTTP/2 requested but httpx[http2] is not installed, using HTTP/1.1 pool")
+
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+    @property
+    def http2(self):
+        return self._client is not None
+
+    def request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        """Signature matches telebot's `apihelper.CUSTOM_REQUEST_SENDER`."""
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        with self._lock:
+            self._requests += 1
+        try:
+            if self._client is not None and not proxies:
+                return self._request_http2(method, url, params, files, timeout)
+            return self._session.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies, verify=self.verify)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def _request_http2(self, method, url, params, files, timeout):
+        import httpx
+
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                with self._lock:
+                    self._http2_connections += 1
+
+        connect_timeout, read_timeout = timeout
+        response = self._client.request(
+            method, url, params=params, files=files,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            extensions={"trace": trace}
+        )
+        # telebot reads `reason` when building API exceptions
+        response.reason = response.reason_phrase
+        return response
+
+    def _pool_connections(self):
+        pools = self._adapter.poolmanager.pools
+        with pools.lock:
+            return sum(pools[key].num_connections for key in pools.keys())
+
+    def metrics(self):
+        connections = self._pool_connections() + self._http2_connections + self._closed_connections
+        with self._lock:
+            requests_sent = self._requests
+            errors = self._errors
+        return {
+            "http2": self.http2,
+            "requests": requests_sent,
+            "errors": errors,
+            "connections_opened": connections,
+            "reuse_ratio": round(1 - connections / requests_sent, 3) if requests_sent else 0,
+        }
+
+    def close(self):
+        # Closing drops the pools along with their counters
+        self._closed_connections += self._pool_connections()
+        self._session.close()
+        if self._client is not None:
+            self._client.close()